@@ -105,3 +105,7 @@ class AppConfigStore(StoreProvider):
             )
 
         return config
+
+    def clear_cache(self) -> None:
+        """Discard configuration cached for `max_age`, so the next fetch retrieves it from AWS AppConfig"""
+        self._conf_store.clear_cache()
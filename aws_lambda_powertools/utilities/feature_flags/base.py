@@ -53,6 +53,12 @@ class StoreProvider(ABC):
         """
         raise NotImplementedError()  # pragma: no cover
 
+    def clear_cache(self) -> None:
+        """Discard any configuration cached by the store, so the next fetch retrieves it from its source
+
+        Stores without a cache don't need to override it.
+        """
+
 
 class BaseValidator(ABC):
     @abstractmethod
@@ -1,15 +1,143 @@
+import copy
 import logging
-from typing import Any, Dict, List, Optional, Union, cast
+import operator
+import threading
+import time
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple, Union
 
 from ... import Logger
+from ...shared.cache_dict import LRUDict
 from ...shared.types import JSONType
-from . import schema
 from .base import StoreProvider
 from .exceptions import ConfigurationStoreError
+from .schema import (
+    CONDITION_ACTION,
+    CONDITION_KEY,
+    CONDITION_VALUE,
+    CONDITIONS_KEY,
+    FEATURE_DEFAULT_VAL_KEY,
+    FEATURE_DEFAULT_VAL_TYPE_KEY,
+    RULE_MATCH_VALUE,
+    RULES_KEY,
+    RuleAction,
+    SchemaValidator,
+)
+
+EVALUATIONS_CACHE_MAX_ITEMS = 1024
+
+# matchers receive (context value, condition value); C implementations are used where argument order allows
+_ACTION_DISPATCH: Dict[str, Callable[[Any, Any], bool]] = {
+    RuleAction.EQUALS.value: operator.eq,
+    RuleAction.NOT_EQUALS.value: operator.ne,
+    RuleAction.KEY_GREATER_THAN_VALUE.value: operator.gt,
+    RuleAction.KEY_GREATER_THAN_OR_EQUAL_VALUE.value: operator.ge,
+    RuleAction.KEY_LESS_THAN_VALUE.value: operator.lt,
+    RuleAction.KEY_LESS_THAN_OR_EQUAL_VALUE.value: operator.le,
+    RuleAction.STARTSWITH.value: str.startswith,
+    RuleAction.ENDSWITH.value: str.endswith,
+    RuleAction.IN.value: lambda a, b: a in b,
+    RuleAction.NOT_IN.value: lambda a, b: a not in b,
+    RuleAction.KEY_IN_VALUE.value: lambda a, b: a in b,
+    RuleAction.KEY_NOT_IN_VALUE.value: lambda a, b: a not in b,
+    RuleAction.VALUE_IN_KEY.value: operator.contains,
+    RuleAction.VALUE_NOT_IN_KEY.value: lambda a, b: b not in a,
+}
+
+
+# actions looking up the context value within the condition value
+_MEMBERSHIP_ACTIONS = frozenset(
+    (
+        RuleAction.IN.value,
+        RuleAction.NOT_IN.value,
+        RuleAction.KEY_IN_VALUE.value,
+        RuleAction.KEY_NOT_IN_VALUE.value,
+    )
+)
+_NEGATED_MEMBERSHIP_ACTIONS = frozenset((RuleAction.NOT_IN.value, RuleAction.KEY_NOT_IN_VALUE.value))
+
+
+def _no_match(context_value: Any, condition_value: Any) -> bool:
+    return False
+
+
+def _to_lookup_value(condition_value: Any) -> Any:
+    """Turns a list condition value into a frozenset for constant time membership, when its members are hashable"""
+    if not isinstance(condition_value, list):
+        return condition_value
+
+    try:
+        return frozenset(condition_value)
+    except TypeError:
+        return condition_value
+
+
+def _not_in_lookup(context_value: Any, lookup: FrozenSet) -> bool:
+    try:
+        return context_value not in lookup
+    except TypeError:
+        # unhashable context values can't be equal to any of the hashable members
+        return True
+
+
+class CompiledCondition:
+    """Condition with its action resolved to the function matching (context value, condition value)"""
+
+    __slots__ = ("key", "action", "func", "value")
+
+    def __init__(self, key: str, action: str, func: Callable[[Any, Any], bool], value: Any):
+        self.key = key
+        self.action = action
+        self.func = func
+        self.value = value
+
+
+class CompiledRule:
+    """Rule with its when_match value and compiled conditions"""
+
+    __slots__ = ("name", "match_value", "conditions")
+
+    def __init__(self, name: str, match_value: JSONType, conditions: Tuple[CompiledCondition, ...]):
+        self.name = name
+        self.match_value = match_value
+        self.conditions = conditions
+
+
+class CompiledFeature:
+    """Feature with its default value, boolean_type and compiled rules in configuration order"""
+
+    __slots__ = ("name", "default", "boolean_type", "rules")
+
+    def __init__(self, name: str, default: JSONType, boolean_type: bool, rules: Tuple[CompiledRule, ...]):
+        self.name = name
+        self.default = default
+        self.boolean_type = boolean_type
+        self.rules = rules
+
+
+# features in configuration order; compiled feature is None when it's enabled by default and has no rules
+EnabledFeaturesPlan = List[Tuple[str, Optional[CompiledFeature]]]
+
+
+class CompiledConfiguration:
+    """Validated configuration along with everything derived from it once per configuration load"""
+
+    __slots__ = ("config", "features", "enabled_features_plan", "evaluations")
+
+    def __init__(self, config: Dict, features: Dict[str, CompiledFeature], enabled_features_plan: EnabledFeaturesPlan):
+        self.config = config
+        self.features = features
+        self.enabled_features_plan = enabled_features_plan
+        # evaluations are only valid for the configuration they were computed against
+        self.evaluations = LRUDict(max_items=EVALUATIONS_CACHE_MAX_ITEMS)
 
 
 class FeatureFlags:
-    def __init__(self, store: StoreProvider, logger: Optional[Union[logging.Logger, Logger]] = None):
+    def __init__(
+        self,
+        store: StoreProvider,
+        logger: Optional[Union[logging.Logger, Logger]] = None,
+        cache_seconds: float = 5.0,
+    ):
         """Evaluates whether feature flags should be enabled based on a given context.
 
         It uses the provided store to fetch feature flag rules before evaluating them.
@@ -37,97 +165,147 @@ class FeatureFlags:
             Store to use to fetch feature flag schema configuration.
         logger: A logging object
             Used to log messages. If None is supplied, one will be created.
+        cache_seconds: float
+            How long to keep the validated configuration in memory before fetching it from the store again,
+            by default 5 seconds. Use `0` to always fetch from the store.
         """
         self.store = store
         self.logger = logger or logging.getLogger(__name__)
+        self._cache_seconds = cache_seconds
+        self._compiled: Optional[CompiledConfiguration] = None
+        self._evaluations_lock = threading.Lock()
+        self._cached_at: float = 0.0
+        self._cache_lock = threading.Lock()
+
+    @staticmethod
+    def _compile_condition(condition: Dict[str, Any]) -> CompiledCondition:
+        """Resolves condition action to its matching function so it's looked up once per configuration load"""
+        action = condition.get(CONDITION_ACTION, "")
+        condition_value = condition.get(CONDITION_VALUE)
+        func = _ACTION_DISPATCH.get(action, _no_match)
+        if action in _MEMBERSHIP_ACTIONS:
+            condition_value = _to_lookup_value(condition_value)
+            if isinstance(condition_value, frozenset) and action in _NEGATED_MEMBERSHIP_ACTIONS:
+                func = _not_in_lookup
+
+        return CompiledCondition(key=str(condition.get(CONDITION_KEY)), action=action, func=func, value=condition_value)
+
+    def _compile_rule(self, rule_name: str, rule: Dict[str, Any], boolean_feature: bool = True) -> CompiledRule:
+        conditions = rule.get(CONDITIONS_KEY) or []
+        rule_match_value = rule.get(RULE_MATCH_VALUE)
+        # Maintenance: Revisit before going GA.
+        if boolean_feature:
+            rule_match_value = bool(rule_match_value)
+
+        return CompiledRule(
+            name=rule_name,
+            match_value=rule_match_value,
+            conditions=tuple(self._compile_condition(condition) for condition in conditions),
+        )
 
-    def _match_by_action(self, action: str, condition_value: Any, context_value: Any) -> bool:
-        if not context_value:
-            return False
-        mapping_by_action = {
-            schema.RuleAction.EQUALS.value: lambda a, b: a == b,
-            schema.RuleAction.NOT_EQUALS.value: lambda a, b: a != b,
-            schema.RuleAction.KEY_GREATER_THAN_VALUE.value: lambda a, b: a > b,
-            schema.RuleAction.KEY_GREATER_THAN_OR_EQUAL_VALUE.value: lambda a, b: a >= b,
-            schema.RuleAction.KEY_LESS_THAN_VALUE.value: lambda a, b: a < b,
-            schema.RuleAction.KEY_LESS_THAN_OR_EQUAL_VALUE.value: lambda a, b: a <= b,
-            schema.RuleAction.STARTSWITH.value: lambda a, b: a.startswith(b),
-            schema.RuleAction.ENDSWITH.value: lambda a, b: a.endswith(b),
-            schema.RuleAction.IN.value: lambda a, b: a in b,
-            schema.RuleAction.NOT_IN.value: lambda a, b: a not in b,
-            schema.RuleAction.KEY_IN_VALUE.value: lambda a, b: a in b,
-            schema.RuleAction.KEY_NOT_IN_VALUE.value: lambda a, b: a not in b,
-            schema.RuleAction.VALUE_IN_KEY.value: lambda a, b: b in a,
-            schema.RuleAction.VALUE_NOT_IN_KEY.value: lambda a, b: b not in a,
-        }
+    def _compile_features(self, features: Dict[str, Any]) -> Dict[str, CompiledFeature]:
+        """Compiles validated features into matchers, sparing evaluations from walking the raw schema"""
+        compiled: Dict[str, CompiledFeature] = {}
+        for name, feature in features.items():
+            rules = feature.get(RULES_KEY) or {}
+            feat_default = feature.get(FEATURE_DEFAULT_VAL_KEY)
+            # backwards compatability ,assume feature flag
+            boolean_feature = feature.get(FEATURE_DEFAULT_VAL_TYPE_KEY, True)
+            # Maintenance: Revisit before going GA. We might to simplify customers on-boarding by not requiring it
+            # for non-boolean flags.
+            if boolean_feature:
+                feat_default = bool(feat_default)
+
+            compiled[name] = CompiledFeature(
+                name=name,
+                default=feat_default,
+                boolean_type=boolean_feature,
+                rules=tuple(self._compile_rule(rule_name, rule, boolean_feature) for rule_name, rule in rules.items()),
+            )
 
-        try:
-            func = mapping_by_action.get(action, lambda a, b: False)
-            return func(context_value, condition_value)
-        except Exception as exc:
-            self.logger.debug(f"caught exception while matching action: action={action}, exception={str(exc)}")
-            return False
+        return compiled
 
-    def _evaluate_conditions(
-        self, rule_name: str, feature_name: str, rule: Dict[str, Any], context: Dict[str, Any]
-    ) -> bool:
-        """Evaluates whether context matches conditions, return False otherwise"""
-        rule_match_value = rule.get(schema.RULE_MATCH_VALUE)
-        conditions = cast(List[Dict], rule.get(schema.CONDITIONS_KEY))
+    @staticmethod
+    def _plan_enabled_features(features: Dict[str, CompiledFeature]) -> EnabledFeaturesPlan:
+        """Resolves which features are enabled regardless of context, so only features with rules are evaluated
+
+        Features that can never be enabled, with no rules and a falsy default, are left out of the plan.
+        """
+        plan: EnabledFeaturesPlan = []
+        for name, feature in features.items():
+            if feature.rules:
+                plan.append((name, feature))
+            elif feature.default:
+                plan.append((name, None))
+            # features without rules and a falsy default can never be enabled
+
+        return plan
 
-        if not conditions:
+    def _evaluate_conditions(self, *, feature_name: str, rule: CompiledRule, context: Dict[str, Any]) -> bool:
+        """Evaluates whether context matches conditions, return False otherwise"""
+        if not rule.conditions:
             self.logger.debug(
-                f"rule did not match, no conditions to match, rule_name={rule_name}, rule_value={rule_match_value}, "
-                f"name={feature_name} "
+                "rule did not match, no conditions to match, rule_name=%s, rule_value=%s, name=%s",
+                rule.name,
+                rule.match_value,
+                feature_name,
             )
             return False
 
-        for condition in conditions:
-            context_value = context.get(str(condition.get(schema.CONDITION_KEY)))
-            cond_action = condition.get(schema.CONDITION_ACTION, "")
-            cond_value = condition.get(schema.CONDITION_VALUE)
+        matched = True
+        try:
+            for condition in rule.conditions:
+                context_value = context.get(condition.key)
+                if not context_value or not condition.func(context_value, condition.value):
+                    matched = False
+                    break
+        except Exception as exc:
+            # a condition failing to match fails the whole rule, as conditions must all match
+            self.logger.debug("caught exception while matching action: action=%s, exception=%s", condition.action, exc)
+            matched = False
 
-            if not self._match_by_action(action=cond_action, condition_value=cond_value, context_value=context_value):
-                self.logger.debug(
-                    f"rule did not match action, rule_name={rule_name}, rule_value={rule_match_value}, "
-                    f"name={feature_name}, context_value={str(context_value)} "
-                )
-                return False  # context doesn't match condition
+        # Context might contain PII data; do not log its value
+        self.logger.debug(
+            "%s, rule_name=%s, rule_value=%s, name=%s",
+            "rule matched" if matched else "rule did not match action",
+            rule.name,
+            rule.match_value,
+            feature_name,
+        )
 
-        self.logger.debug(f"rule matched, rule_name={rule_name}, rule_value={rule_match_value}, name={feature_name}")
-        return True
+        return matched
 
-    def _evaluate_rules(
-        self,
-        *,
-        feature_name: str,
-        context: Dict[str, Any],
-        feat_default: Any,
-        rules: Dict[str, Any],
-        boolean_feature: bool,
-    ) -> bool:
+    def _evaluate_rules(self, *, feature: CompiledFeature, context: Dict[str, Any]) -> JSONType:
         """Evaluates whether context matches rules and conditions, otherwise return feature default"""
-        for rule_name, rule in rules.items():
-            rule_match_value = rule.get(schema.RULE_MATCH_VALUE)
-
+        for rule in feature.rules:
             # Context might contain PII data; do not log its value
             self.logger.debug(
-                f"Evaluating rule matching, rule={rule_name}, feature={feature_name}, default={str(feat_default)}, boolean_feature={boolean_feature}"  # noqa: E501
+                "Evaluating rule matching, rule=%s, feature=%s, default=%s, boolean_feature=%s",
+                rule.name,
+                feature.name,
+                feature.default,
+                feature.boolean_type,
             )
-            if self._evaluate_conditions(rule_name=rule_name, feature_name=feature_name, rule=rule, context=context):
-                # Maintenance: Revisit before going GA.
-                return bool(rule_match_value) if boolean_feature else rule_match_value
+            if self._evaluate_conditions(feature_name=feature.name, rule=rule, context=context):
+                return rule.match_value
 
         # no rule matched, return default value of feature
         self.logger.debug(
-            f"no rule matched, returning feature default, default={str(feat_default)}, name={feature_name}, boolean_feature={boolean_feature}"  # noqa: E501
+            "no rule matched, returning feature default, default=%s, name=%s, boolean_feature=%s",
+            feature.default,
+            feature.name,
+            feature.boolean_type,
         )
-        return feat_default
+        return feature.default
 
     def get_configuration(self) -> Dict:
         """Get validated feature flag schema from configured store.
 
-        Largely used to aid testing, since it's called by `evaluate` and `get_enabled_features` methods.
+        Largely used to aid testing, since it returns the same configuration `evaluate` and
+        `get_enabled_features` methods evaluate against.
+
+        Validated configuration is kept in memory for `cache_seconds` to avoid fetching and validating
+        it on every evaluation. A copy is returned, so changing it doesn't affect feature evaluation.
 
         Raises
         ------
@@ -166,13 +344,41 @@ class FeatureFlags:
         }
         ```
         """
-        # parse result conf as JSON, keep in cache for max age defined in store
-        self.logger.debug(f"Fetching schema from registered store, store={self.store}")
-        config: Dict = self.store.get_configuration()
-        validator = schema.SchemaValidator(schema=config)
-        validator.validate()
+        return copy.deepcopy(self._load_configuration().config)
+
+    def _load_configuration(self) -> CompiledConfiguration:
+        """Get validated configuration compiled for evaluation, refreshing it from the store when expired"""
+        with self._cache_lock:
+            if self._compiled is not None and time.monotonic() - self._cached_at < self._cache_seconds:
+                return self._compiled
+
+            # store keeps parsed JSON for its own max age; compiled result is kept here for cache_seconds
+            self.logger.debug("Fetching schema from registered store, store=%s", self.store)
+            config: Dict = self.store.get_configuration()
+            validator = SchemaValidator(schema=config)
+            validator.validate()
+
+            features = self._compile_features(config)
+            self._compiled = CompiledConfiguration(
+                config=config, features=features, enabled_features_plan=self._plan_enabled_features(features)
+            )
+            self._cached_at = time.monotonic()
+            return self._compiled
 
-        return config
+    def invalidate(self) -> None:
+        """Discard the in-memory configuration and the store's cache, so the next evaluation fetches it again.
+
+        Useful when you know the configuration has changed, e.g. from a configuration update callback.
+        """
+        with self._cache_lock:
+            self._compiled = None
+            self._cached_at = 0.0
+            self.store.clear_cache()
+
+    @staticmethod
+    def _detach_value(feature: CompiledFeature, value: JSONType) -> JSONType:
+        """Copies non-boolean values, so callers changing them don't alter the cached configuration"""
+        return value if feature.boolean_type else copy.deepcopy(value)
 
     def evaluate(self, *, name: str, context: Optional[Dict[str, Any]] = None, default: JSONType) -> JSONType:
         """Evaluate whether a feature flag should be enabled according to stored schema and input context
@@ -210,39 +416,54 @@ class FeatureFlags:
             context = {}
 
         try:
-            features = self.get_configuration()
+            compiled = self._load_configuration()
         except ConfigurationStoreError as err:
-            self.logger.debug(f"Failed to fetch feature flags from store, returning default provided, reason={err}")
+            self.logger.debug("Failed to fetch feature flags from store, returning default provided, reason=%s", err)
             return default
 
-        feature = features.get(name)
+        feature = compiled.features.get(name)
         if feature is None:
-            self.logger.debug(f"Feature not found; returning default provided, name={name}, default={default}")
+            self.logger.debug("Feature not found; returning default provided, name=%s, default=%s", name, default)
             return default
 
-        rules = feature.get(schema.RULES_KEY)
-        feat_default = feature.get(schema.FEATURE_DEFAULT_VAL_KEY)
         # Maintenance: Revisit before going GA. We might to simplify customers on-boarding by not requiring it
         # for non-boolean flags. It'll need minor implementation changes, docs changes, and maybe refactor
         # get_enabled_features. We can minimize breaking change, despite Beta label, by having a new
         # method `get_matching_features` returning Dict[feature_name, feature_value]
-        boolean_feature = feature.get(
-            schema.FEATURE_DEFAULT_VAL_TYPE_KEY, True
-        )  # backwards compatability ,assume feature flag
-        if not rules:
+        if not feature.rules:
             self.logger.debug(
-                f"no rules found, returning feature default, name={name}, default={str(feat_default)}, boolean_feature={boolean_feature}"  # noqa: E501
+                "no rules found, returning feature default, name=%s, default=%s, boolean_feature=%s",
+                name,
+                feature.default,
+                feature.boolean_type,
             )
-            # Maintenance: Revisit before going GA. We might to simplify customers on-boarding by not requiring it
-            # for non-boolean flags.
-            return bool(feat_default) if boolean_feature else feat_default
+            return self._detach_value(feature, feature.default)
+
+        evaluations = compiled.evaluations
+        try:
+            evaluation_key: Optional[Tuple[str, FrozenSet]] = (name, frozenset(context.items()))
+        except TypeError:
+            # unhashable context values (e.g. dict) can't be memoized
+            evaluation_key = None
+        else:
+            with self._evaluations_lock:
+                if evaluation_key in evaluations:
+                    value = evaluations[evaluation_key]
+                    self.logger.debug("returning memoized evaluation, name=%s, value=%s", name, value)
+                    return self._detach_value(feature, value)
 
         self.logger.debug(
-            f"looking for rule match, name={name}, default={str(feat_default)}, boolean_feature={boolean_feature}"  # noqa: E501
-        )
-        return self._evaluate_rules(
-            feature_name=name, context=context, feat_default=feat_default, rules=rules, boolean_feature=boolean_feature
+            "looking for rule match, name=%s, default=%s, boolean_feature=%s",
+            name,
+            feature.default,
+            feature.boolean_type,
         )
+        value = self._evaluate_rules(feature=feature, context=context)
+        if evaluation_key is not None:
+            with self._evaluations_lock:
+                evaluations[evaluation_key] = value
+
+        return self._detach_value(feature, value)
 
     def get_enabled_features(self, *, context: Optional[Dict[str, Any]] = None) -> List[str]:
         """Get all enabled feature flags while also taking into account context
@@ -276,30 +497,22 @@ class FeatureFlags:
         features_enabled: List[str] = []
 
         try:
-            features: Dict[str, Any] = self.get_configuration()
+            plan = self._load_configuration().enabled_features_plan
         except ConfigurationStoreError as err:
-            self.logger.debug(f"Failed to fetch feature flags from store, returning empty list, reason={err}")
+            self.logger.debug("Failed to fetch feature flags from store, returning empty list, reason=%s", err)
             return features_enabled
 
         self.logger.debug("Evaluating all features")
-        for name, feature in features.items():
-            rules = feature.get(schema.RULES_KEY, {})
-            feature_default_value = feature.get(schema.FEATURE_DEFAULT_VAL_KEY)
-            boolean_feature = feature.get(
-                schema.FEATURE_DEFAULT_VAL_TYPE_KEY, True
-            )  # backwards compatability ,assume feature flag
-
-            if feature_default_value and not rules:
-                self.logger.debug(f"feature is enabled by default and has no defined rules, name={name}")
-                features_enabled.append(name)
-            elif self._evaluate_rules(
-                feature_name=name,
-                context=context,
-                feat_default=feature_default_value,
-                rules=rules,
-                boolean_feature=boolean_feature,
-            ):
-                self.logger.debug(f"feature's calculated value is True, name={name}")
-                features_enabled.append(name)
+        # bind once as this loop runs for every feature in the configuration
+        debug = self.logger.debug
+        evaluate_rules = self._evaluate_rules
+        enable = features_enabled.append
+        for name, feature in plan:
+            if feature is None:
+                debug("feature is enabled by default and has no defined rules, name=%s", name)
+                enable(name)
+            elif evaluate_rules(feature=feature, context=context):
+                debug("feature's calculated value is True, name=%s", name)
+                enable(name)
 
         return features_enabled
@@ -1,3 +1,4 @@
+import logging
 from typing import Dict, List, Optional
 
 import pytest
@@ -6,7 +7,7 @@ from botocore.config import Config
 from aws_lambda_powertools.utilities.feature_flags import ConfigurationStoreError, schema
 from aws_lambda_powertools.utilities.feature_flags.appconfig import AppConfigStore
 from aws_lambda_powertools.utilities.feature_flags.exceptions import StoreClientError
-from aws_lambda_powertools.utilities.feature_flags.feature_flags import FeatureFlags
+from aws_lambda_powertools.utilities.feature_flags.feature_flags import CompiledRule, FeatureFlags, _no_match
 from aws_lambda_powertools.utilities.feature_flags.schema import (
     CONDITION_ACTION,
     CONDITION_KEY,
@@ -676,34 +677,58 @@ def test_app_config_get_parameter_err(mocker, config):
     assert "AWS AppConfig configuration" in str(err.value)
 
 
-def test_match_by_action_no_matching_action(mocker, config):
-    # GIVEN an unsupported action
+def test_compile_condition_no_matching_action(mocker, config):
+    # GIVEN an unsupported action, which SchemaValidator would otherwise reject
     feature_flags = init_feature_flags(mocker, {}, config)
-    # WHEN calling _match_by_action
-    result = feature_flags._match_by_action("Foo", None, "foo")
-    # THEN default to False
-    assert result is False
+    condition = feature_flags._compile_condition(
+        {CONDITION_ACTION: "Foo", CONDITION_KEY: "tenant_id", CONDITION_VALUE: "foo"}
+    )
+    rule = CompiledRule(name="dummy", match_value=True, conditions=(condition,))
 
+    # WHEN evaluating a rule with that condition
+    result = feature_flags._evaluate_conditions(feature_name="dummy", rule=rule, context={"tenant_id": "foo"})
 
-def test_match_by_action_attribute_error(mocker, config):
-    # GIVEN a startswith action and 2 integer
-    feature_flags = init_feature_flags(mocker, {}, config)
-    # WHEN calling _match_by_action
-    result = feature_flags._match_by_action(RuleAction.STARTSWITH.value, 1, 100)
-    # THEN swallow the AttributeError and return False
+    # THEN the action should resolve to no match
+    assert condition.func is _no_match
     assert result is False
 
 
+def test_flags_startswith_action_with_non_string_context_value(mocker, config):
+    # GIVEN a startswith condition
+    mocked_app_config_schema = {
+        "my_feature": {
+            FEATURE_DEFAULT_VAL_KEY: False,
+            RULES_KEY: {
+                "tenant id startswith 1": {
+                    RULE_MATCH_VALUE: True,
+                    CONDITIONS_KEY: [
+                        {
+                            CONDITION_ACTION: RuleAction.STARTSWITH.value,
+                            CONDITION_KEY: "tenant_id",
+                            CONDITION_VALUE: "1",
+                        }
+                    ],
+                }
+            },
+        }
+    }
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+
+    # WHEN evaluating it with an integer context value
+    toggle = feature_flags.evaluate(name="my_feature", context={"tenant_id": 100}, default=True)
+
+    # THEN swallow the TypeError and return the feature default
+    assert toggle is False
+
+
 def test_is_rule_matched_no_matches(mocker, config):
     # GIVEN an empty list of conditions
-    rule = {schema.CONDITIONS_KEY: []}
-    rules_context = {}
     feature_flags = init_feature_flags(mocker, {}, config)
+    rule = feature_flags._compile_rule("dummy", {schema.CONDITIONS_KEY: []})
+    rules_context = {}
 
     # WHEN calling _evaluate_conditions
-    result = feature_flags._evaluate_conditions(
-        rule_name="dummy", feature_name="dummy", rule=rule, context=rules_context
-    )
+    result = feature_flags._evaluate_conditions(feature_name="dummy", rule=rule, context=rules_context)
 
     # THEN return False
     assert result is False
@@ -1288,3 +1313,404 @@ def test_get_all_enabled_features_non_boolean_truthy_defaults(mocker, config):
     feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
     enabled_list: List[str] = feature_flags.get_enabled_features(context={"tenant_id": "6", "username": "a"})
     assert enabled_list == expected_value
+
+
+def test_get_configuration_cached_within_cache_seconds(mocker, config):
+    # GIVEN a feature flags instance with an in-memory cache
+    mocked_app_config_schema = {"my_feature": {FEATURE_DEFAULT_VAL_KEY: True}}
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+    store_spy = mocker.spy(feature_flags.store, "get_configuration")
+
+    # WHEN evaluating features several times
+    feature_flags.evaluate(name="my_feature", default=False)
+    feature_flags.evaluate(name="my_feature", default=False)
+    feature_flags.get_enabled_features()
+
+    # THEN the store should be hit only once
+    assert store_spy.call_count == 1
+
+
+def test_get_configuration_invalidate(mocker, config):
+    # GIVEN a feature flags instance with a cached configuration
+    mocked_app_config_schema = {"my_feature": {FEATURE_DEFAULT_VAL_KEY: True}}
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+    store_spy = mocker.spy(feature_flags.store, "get_configuration")
+    feature_flags.evaluate(name="my_feature", default=False)
+
+    # WHEN invalidating the cache
+    feature_flags.invalidate()
+    feature_flags.evaluate(name="my_feature", default=False)
+
+    # THEN the configuration should be fetched from the store again
+    assert store_spy.call_count == 2
+
+
+def test_get_configuration_cache_disabled(mocker, config):
+    # GIVEN a feature flags instance with in-memory cache disabled
+    mocked_app_config_schema = {"my_feature": {FEATURE_DEFAULT_VAL_KEY: True}}
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+    feature_flags = FeatureFlags(store=feature_flags.store, cache_seconds=0)
+    store_spy = mocker.spy(feature_flags.store, "get_configuration")
+
+    # WHEN evaluating features several times
+    feature_flags.evaluate(name="my_feature", default=False)
+    feature_flags.evaluate(name="my_feature", default=False)
+
+    # THEN every evaluation should fetch from the store
+    assert store_spy.call_count == 2
+
+
+def test_rules_compiled_once_per_configuration_load(mocker, config):
+    # GIVEN a feature with rules
+    mocked_app_config_schema = {
+        "my_feature": {
+            FEATURE_DEFAULT_VAL_KEY: False,
+            RULES_KEY: {
+                "tenant id equals 6": {
+                    RULE_MATCH_VALUE: True,
+                    CONDITIONS_KEY: [
+                        {CONDITION_ACTION: RuleAction.EQUALS.value, CONDITION_KEY: "tenant_id", CONDITION_VALUE: "6"}
+                    ],
+                }
+            },
+        }
+    }
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+    compile_spy = mocker.spy(feature_flags, "_compile_features")
+
+    # WHEN evaluating it several times
+    assert feature_flags.evaluate(name="my_feature", context={"tenant_id": "6"}, default=False) is True
+    assert feature_flags.evaluate(name="my_feature", context={"tenant_id": "7"}, default=False) is False
+    assert feature_flags.get_enabled_features(context={"tenant_id": "6"}) == ["my_feature"]
+
+    # THEN rules should only be compiled once
+    assert compile_spy.call_count == 1
+
+
+def test_evaluate_memoizes_result_for_same_context(mocker, config):
+    # GIVEN a feature with rules
+    mocked_app_config_schema = {
+        "my_feature": {
+            FEATURE_DEFAULT_VAL_KEY: False,
+            RULES_KEY: {
+                "tenant id equals 6": {
+                    RULE_MATCH_VALUE: True,
+                    CONDITIONS_KEY: [
+                        {CONDITION_ACTION: RuleAction.EQUALS.value, CONDITION_KEY: "tenant_id", CONDITION_VALUE: "6"}
+                    ],
+                }
+            },
+        }
+    }
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+    rules_spy = mocker.spy(feature_flags, "_evaluate_rules")
+
+    # WHEN evaluating it several times with the same context
+    assert feature_flags.evaluate(name="my_feature", context={"tenant_id": "6"}, default=False) is True
+    assert feature_flags.evaluate(name="my_feature", context={"tenant_id": "6"}, default=False) is True
+    assert feature_flags.evaluate(name="my_feature", context={"tenant_id": "7"}, default=False) is False
+
+    # THEN rules should only be evaluated once per distinct context
+    assert rules_spy.call_count == 2
+
+    # WHEN the configuration is invalidated
+    feature_flags.invalidate()
+    assert feature_flags.evaluate(name="my_feature", context={"tenant_id": "6"}, default=False) is True
+
+    # THEN memoized evaluations should be discarded too
+    assert rules_spy.call_count == 3
+
+
+def test_evaluate_unhashable_context_not_memoized(mocker, config):
+    # GIVEN a feature matching on a dict value
+    mocked_app_config_schema = {
+        "my_feature": {
+            FEATURE_DEFAULT_VAL_KEY: False,
+            RULES_KEY: {
+                "tenant equals": {
+                    RULE_MATCH_VALUE: True,
+                    CONDITIONS_KEY: [
+                        {CONDITION_ACTION: RuleAction.EQUALS.value, CONDITION_KEY: "tenant", CONDITION_VALUE: {"a": 1}}
+                    ],
+                }
+            },
+        }
+    }
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+    rules_spy = mocker.spy(feature_flags, "_evaluate_rules")
+
+    # WHEN evaluating it twice with an unhashable context value
+    assert feature_flags.evaluate(name="my_feature", context={"tenant": {"a": 1}}, default=False) is True
+    assert feature_flags.evaluate(name="my_feature", context={"tenant": {"a": 1}}, default=False) is True
+
+    # THEN rules should be evaluated every time
+    assert rules_spy.call_count == 2
+
+
+def test_flags_evaluates_next_rule_when_previous_rule_partially_matches(mocker, config):
+    # GIVEN a first rule whose first condition matches but second doesn't, and a second matching rule
+    mocked_app_config_schema = {
+        "my_feature": {
+            FEATURE_DEFAULT_VAL_KEY: {"tier": "free"},
+            FEATURE_DEFAULT_VAL_TYPE_KEY: False,
+            RULES_KEY: {
+                "tenant id equals 6 and username equals b": {
+                    RULE_MATCH_VALUE: {"tier": "premium"},
+                    CONDITIONS_KEY: [
+                        {CONDITION_ACTION: RuleAction.EQUALS.value, CONDITION_KEY: "tenant_id", CONDITION_VALUE: "6"},
+                        {CONDITION_ACTION: RuleAction.EQUALS.value, CONDITION_KEY: "username", CONDITION_VALUE: "b"},
+                    ],
+                },
+                "username equals a": {
+                    RULE_MATCH_VALUE: {"tier": "standard"},
+                    CONDITIONS_KEY: [
+                        {CONDITION_ACTION: RuleAction.EQUALS.value, CONDITION_KEY: "username", CONDITION_VALUE: "a"},
+                    ],
+                },
+            },
+        }
+    }
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+
+    # WHEN evaluating a context matching only the second rule
+    value = feature_flags.evaluate(name="my_feature", context={"tenant_id": "6", "username": "a"}, default={})
+
+    # THEN the second rule's value should be returned
+    assert value == {"tier": "standard"}
+
+
+def test_flags_match_rule_with_in_action_unhashable_values(mocker, config):
+    # GIVEN an IN condition whose value contains unhashable members
+    mocked_app_config_schema = {
+        "my_feature": {
+            FEATURE_DEFAULT_VAL_KEY: False,
+            RULES_KEY: {
+                "tenant is one of": {
+                    RULE_MATCH_VALUE: True,
+                    CONDITIONS_KEY: [
+                        {
+                            CONDITION_ACTION: RuleAction.IN.value,
+                            CONDITION_KEY: "tenant",
+                            CONDITION_VALUE: [{"tenant_id": "6"}, "7"],
+                        }
+                    ],
+                }
+            },
+        }
+    }
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+
+    # WHEN evaluating contexts with either member
+    # THEN both should match
+    assert feature_flags.evaluate(name="my_feature", context={"tenant": {"tenant_id": "6"}}, default=False) is True
+    assert feature_flags.evaluate(name="my_feature", context={"tenant": "7"}, default=False) is True
+    assert feature_flags.evaluate(name="my_feature", context={"tenant": "8"}, default=False) is False
+
+
+def test_flags_match_rule_with_not_in_action_unhashable_context_value(mocker, config):
+    # GIVEN a NOT_IN condition whose value only contains hashable members
+    mocked_app_config_schema = {
+        "my_feature": {
+            FEATURE_DEFAULT_VAL_KEY: False,
+            RULES_KEY: {
+                "tenant id is not one of": {
+                    RULE_MATCH_VALUE: True,
+                    CONDITIONS_KEY: [
+                        {CONDITION_ACTION: RuleAction.NOT_IN.value, CONDITION_KEY: "tenant_id", CONDITION_VALUE: ["6"]}
+                    ],
+                }
+            },
+        }
+    }
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+
+    # WHEN evaluating an unhashable context value
+    toggle = feature_flags.evaluate(name="my_feature", context={"tenant_id": ["7"]}, default=False)
+
+    # THEN it should match since it isn't equal to any member
+    assert toggle is True
+
+
+def test_get_enabled_features_skips_features_that_can_never_be_enabled(mocker, config):
+    # GIVEN features enabled by default, disabled without rules, and with rules
+    mocked_app_config_schema = {
+        "my_disabled_feature": {FEATURE_DEFAULT_VAL_KEY: False},
+        "my_enabled_feature": {FEATURE_DEFAULT_VAL_KEY: True},
+        "my_rule_feature": {
+            FEATURE_DEFAULT_VAL_KEY: False,
+            RULES_KEY: {
+                "tenant id equals 6": {
+                    RULE_MATCH_VALUE: True,
+                    CONDITIONS_KEY: [
+                        {CONDITION_ACTION: RuleAction.EQUALS.value, CONDITION_KEY: "tenant_id", CONDITION_VALUE: "6"}
+                    ],
+                }
+            },
+        },
+    }
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+    rules_spy = mocker.spy(feature_flags, "_evaluate_rules")
+
+    # WHEN getting all enabled features
+    enabled_list = feature_flags.get_enabled_features(context={"tenant_id": "6"})
+
+    # THEN only the feature with rules should be evaluated
+    assert enabled_list == ["my_enabled_feature", "my_rule_feature"]
+    assert rules_spy.call_count == 1
+
+
+def test_flags_rule_does_not_match_when_a_condition_raises(mocker, config):
+    # GIVEN a rule whose first condition raises on an int context value, followed by a matching condition
+    mocked_app_config_schema = {
+        "my_feature": {
+            FEATURE_DEFAULT_VAL_KEY: {"tier": "free"},
+            FEATURE_DEFAULT_VAL_TYPE_KEY: False,
+            RULES_KEY: {
+                "tenant id startswith 6 and username equals a": {
+                    RULE_MATCH_VALUE: {"tier": "premium"},
+                    CONDITIONS_KEY: [
+                        {
+                            CONDITION_ACTION: RuleAction.STARTSWITH.value,
+                            CONDITION_KEY: "tenant_id",
+                            CONDITION_VALUE: "6",
+                        },
+                        {CONDITION_ACTION: RuleAction.EQUALS.value, CONDITION_KEY: "username", CONDITION_VALUE: "a"},
+                    ],
+                }
+            },
+        }
+    }
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+
+    # WHEN evaluating a context matching the second condition only
+    value = feature_flags.evaluate(name="my_feature", context={"tenant_id": 6, "username": "a"}, default={})
+
+    # THEN the rule should not match and the feature default should be returned
+    assert value == {"tier": "free"}
+
+
+def test_get_configuration_returns_copy(mocker, config):
+    # GIVEN a feature enabled by default
+    mocked_app_config_schema = {"my_feature": {FEATURE_DEFAULT_VAL_KEY: True}}
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+
+    # WHEN changing the configuration returned
+    features_config = feature_flags.get_configuration()
+    features_config["my_feature"][FEATURE_DEFAULT_VAL_KEY] = False
+
+    # THEN neither later calls nor evaluations should be affected
+    assert feature_flags.get_configuration()["my_feature"][FEATURE_DEFAULT_VAL_KEY] is True
+    assert feature_flags.evaluate(name="my_feature", default=False) is True
+
+
+def test_evaluate_logs_memoized_evaluation(mocker, config, caplog):
+    # GIVEN a feature with rules already evaluated for a context
+    mocked_app_config_schema = {
+        "my_feature": {
+            FEATURE_DEFAULT_VAL_KEY: False,
+            RULES_KEY: {
+                "tenant id equals 6": {
+                    RULE_MATCH_VALUE: True,
+                    CONDITIONS_KEY: [
+                        {CONDITION_ACTION: RuleAction.EQUALS.value, CONDITION_KEY: "tenant_id", CONDITION_VALUE: "6"}
+                    ],
+                }
+            },
+        }
+    }
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+    feature_flags.evaluate(name="my_feature", context={"tenant_id": "6"}, default=False)
+
+    # WHEN evaluating it again for the same context with DEBUG enabled
+    with caplog.at_level(logging.DEBUG, logger=feature_flags.logger.name):
+        feature_flags.evaluate(name="my_feature", context={"tenant_id": "6"}, default=False)
+
+    # THEN the memo hit should be logged
+    assert "returning memoized evaluation, name=my_feature" in caplog.text
+
+
+def test_invalidate_clears_store_cache(mocker, config):
+    # GIVEN an AppConfig store caching its configuration for a while
+    mocked_get = mocker.patch("aws_lambda_powertools.utilities.parameters.AppConfigProvider._get")
+    mocked_get.return_value = '{"my_feature": {"default": true}}'
+    app_conf_store = AppConfigStore(
+        environment="test_env", application="test_app", name="test_conf_name", max_age=300, sdk_config=config
+    )
+    feature_flags = FeatureFlags(store=app_conf_store)
+    assert feature_flags.evaluate(name="my_feature", default=False) is True
+
+    # WHEN the configuration changes in AppConfig and the feature flags are invalidated
+    mocked_get.return_value = '{"my_feature": {"default": false}}'
+    feature_flags.invalidate()
+
+    # THEN the new configuration should be fetched despite the store's max_age
+    assert feature_flags.evaluate(name="my_feature", default=True) is False
+    assert mocked_get.call_count == 2
+
+
+def test_evaluate_non_boolean_values_are_copies(mocker, config):
+    # GIVEN a non-boolean feature with rules
+    mocked_app_config_schema = {
+        "my_feature": {
+            FEATURE_DEFAULT_VAL_KEY: {"tier": "free"},
+            FEATURE_DEFAULT_VAL_TYPE_KEY: False,
+            RULES_KEY: {
+                "tenant id equals 6": {
+                    RULE_MATCH_VALUE: {"tier": "premium"},
+                    CONDITIONS_KEY: [
+                        {CONDITION_ACTION: RuleAction.EQUALS.value, CONDITION_KEY: "tenant_id", CONDITION_VALUE: "6"}
+                    ],
+                }
+            },
+        }
+    }
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+
+    # WHEN changing values returned for a rule match, a memoized rule match and the feature default
+    feature_flags.evaluate(name="my_feature", context={"tenant_id": "6"}, default={})["tier"] = "changed"
+    feature_flags.evaluate(name="my_feature", context={"tenant_id": "6"}, default={})["tier"] = "changed"
+    feature_flags.evaluate(name="my_feature", context={"tenant_id": "7"}, default={})["tier"] = "changed"
+
+    # THEN later evaluations should be unaffected
+    assert feature_flags.evaluate(name="my_feature", context={"tenant_id": "6"}, default={}) == {"tier": "premium"}
+    assert feature_flags.evaluate(name="my_feature", context={"tenant_id": "7"}, default={}) == {"tier": "free"}
+
+
+def test_get_configuration_cache_expires_after_cache_seconds(mocker, config):
+    # GIVEN a feature flags instance caching configuration for 5 seconds and a controlled clock
+    mocked_app_config_schema = {
+        "my_feature": {
+            FEATURE_DEFAULT_VAL_KEY: False,
+            RULES_KEY: {
+                "tenant id equals 6": {
+                    RULE_MATCH_VALUE: True,
+                    CONDITIONS_KEY: [
+                        {CONDITION_ACTION: RuleAction.EQUALS.value, CONDITION_KEY: "tenant_id", CONDITION_VALUE: "6"}
+                    ],
+                }
+            },
+        }
+    }
+    feature_flags = init_feature_flags(mocker, mocked_app_config_schema, config)
+    feature_flags = FeatureFlags(store=feature_flags.store, cache_seconds=5)
+    mocked_clock = mocker.patch("aws_lambda_powertools.utilities.feature_flags.feature_flags.time.monotonic")
+    store_spy = mocker.spy(feature_flags.store, "get_configuration")
+    rules_spy = mocker.spy(feature_flags, "_evaluate_rules")
+
+    # WHEN evaluating the same context before cache_seconds elapse
+    mocked_clock.return_value = 100.0
+    feature_flags.evaluate(name="my_feature", context={"tenant_id": "6"}, default=False)
+    mocked_clock.return_value = 104.9
+    feature_flags.evaluate(name="my_feature", context={"tenant_id": "6"}, default=False)
+
+    # THEN the store should be hit once and the evaluation memoized
+    assert store_spy.call_count == 1
+    assert rules_spy.call_count == 1
+
+    # WHEN evaluating it again once cache_seconds elapsed
+    mocked_clock.return_value = 105.0
+    feature_flags.evaluate(name="my_feature", context={"tenant_id": "6"}, default=False)
+
+    # THEN the configuration should be fetched again and memoized evaluations discarded
+    assert store_spy.call_count == 2
+    assert rules_spy.call_count == 2